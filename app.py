@@ -1,8 +1,18 @@
 import streamlit as st
 import xmlrpc.client
 import os
-import pandas as pd
 import math
+import csv
+import functools
+import importlib.util
+import threading
+import json
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -16,9 +26,32 @@ ODOO_USERNAME = os.getenv('ODOO_USERNAME')
 ODOO_PASSWORD = os.getenv('ODOO_PASSWORD')
 APP_USERNAME = os.getenv('APP_USERNAME', 'admin')
 APP_PASSWORD = os.getenv('APP_PASSWORD', 'admin123')
+REPORT_DIR = os.getenv('REPORT_DIR', 'reports')
+STYLESHEET_URL = os.getenv('STYLESHEET_URL', 'app/static/style.css')
+HISTORY_DB = os.getenv('HISTORY_DB', 'history.sqlite3')
+PLAN_DIR = os.getenv('PLAN_DIR', 'plans')
+
+# RPC budgets shared by every session in this process (calls/s and concurrent calls).
+# Off (0 = unlimited) until a ceiling is agreed with the Odoo host; set them to enforce it.
+ODOO_READ_RATE = float(os.getenv('ODOO_READ_RATE', '0'))
+ODOO_WRITE_RATE = float(os.getenv('ODOO_WRITE_RATE', '0'))
+ODOO_MAX_IN_FLIGHT = int(os.getenv('ODOO_MAX_IN_FLIGHT', '0'))
+# gzip request bodies larger than this many bytes (needs a server/proxy that accepts them; -1 = off)
+ODOO_GZIP_REQUEST_THRESHOLD = int(os.getenv('ODOO_GZIP_REQUEST_THRESHOLD', '-1'))
+
+# Opt-in profiling: 'timer' (stage timings) or 'cprofile' (full call stats)
+PROFILE_MODE = os.getenv('PROFILE_MODE', '').lower()
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
 
 # --- CONSTANTS ---
 SOURCE_STORE_NAME = "Wedtree eStore Private Limited - HO"
+REPORT_COLUMNS = ['product_id', 'sku', 'product', 'new_cost', 'status']
+PLAN_VERSION = 1
+PLAN_WRITE_CHUNK = 500  # product ids per bulk write
+REPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
 
 # --- SESSION STATE INITIALIZATION ---
 def init_session_state():
@@ -39,7 +72,13 @@ def init_session_state():
         'source_store_id': None,
         'target_store_name': '',
         'source_store_name': SOURCE_STORE_NAME,
-        'key_version': 0  # <--- NEW: Controls widget reset for checkboxes
+        'key_version': 0,  # <--- NEW: Controls widget reset for checkboxes
+        'overview_df': None,
+        'companies_future': None,
+        'report_path': None,
+        'plan_path': None,
+        'scope_categ_ids': [],
+        'history_rows': None  # last History search, re-run only on submit
     }
     
     for key, value in defaults.items():
@@ -70,189 +109,261 @@ def on_target_change():
     st.session_state.selected_products = set()
     st.session_state.ref_cost_map = {}
     st.session_state.results_df = None
+    st.session_state.report_path = None
+    st.session_state.plan_path = None
     st.session_state.page_number = 1
     st.session_state.key_version = 0  # Reset version on store change
+    st.session_state.scope_categ_ids = []
 
 # --- CUSTOM CSS FOR ENHANCED UI ---
-st.markdown("""
-<style>
-    /* Main container styling */
-    .main .block-container {
-        padding-top: 1.5rem;
-        padding-bottom: 1rem;
-    }
-    
-    /* Card styling */
-    .card {
-        background: white;
-        border-radius: 12px;
-        padding: 1.25rem;
-        box-shadow: 0 3px 10px rgba(0, 0, 0, 0.08);
-        margin-bottom: 1rem;
-        border: 1px solid #e6e6e6;
-        transition: all 0.3s ease;
-    }
-    
-    .card:hover {
-        box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-    }
-    
-    /* Hero/Landing Page Styling */
-    .hero-container {
-        text-align: center;
-        padding: 3rem 1rem;
-        background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%);
-        border-radius: 15px;
-        margin-bottom: 2rem;
-    }
-    
-    .feature-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 10px;
-        border: 1px solid #eee;
-        height: 100%;
-        text-align: center;
-    }
-    
-    /* Button styling */
-    .stButton > button {
-        border-radius: 8px;
-        padding: 0.5rem 1.25rem;
-        font-weight: 500;
-        transition: all 0.2s ease;
-        border: none;
-        font-size: 0.9rem;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-1px);
-        box-shadow: 0 3px 6px rgba(0, 0, 0, 0.15);
-    }
-    
-    /* Sidebar styling */
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #f8f9fa 0%, #ffffff 100%);
-        border-right: 1px solid #e9ecef;
-    }
-    
-    /* Store config card */
-    .store-config-card {
-        background: white;
-        border-radius: 10px;
-        padding: 1rem;
-        border: 1px solid #e9ecef;
-        margin: 0.75rem 0;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-    }
-    
-    /* Login container */
-    .login-container {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        border-radius: 10px;
-        padding: 1.5rem;
-        color: white;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-    }
-    
-    /* Product card */
-    .product-card {
-        border: 1px solid #e9ecef;
-        border-radius: 8px;
-        padding: 0.9rem;
-        margin-bottom: 0.6rem;
-        background: white;
-        transition: all 0.2s ease;
-    }
-    
-    .product-card:hover {
-        border-color: #667eea;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.1);
-    }
-    
-    .product-card.selected {
-        border-left: 4px solid #28a745;
-        background: linear-gradient(to right, #f8fff8, #ffffff);
-    }
-    
-    /* Stats card */
-    .stats-card {
-        background: white;
-        border-radius: 10px;
-        padding: 1rem;
-        border: 1px solid #e9ecef;
-        margin-bottom: 0.75rem;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-    }
-    
-    /* Tab styling */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 0.5rem;
-        padding: 0 0.25rem;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        border-radius: 6px;
-        padding: 0.6rem 1.2rem;
-        font-weight: 500;
-        font-size: 0.9rem;
-        border: 1px solid #e9ecef;
-        background: white;
-    }
-    
-    .stTabs [aria-selected="true"] {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-        color: white !important;
-        border-color: #667eea !important;
-    }
-    
-    /* Status badges */
-    .status-badge {
-        display: inline-block;
-        padding: 0.2rem 0.6rem;
-        border-radius: 12px;
-        font-size: 0.8rem;
-        font-weight: 500;
-    }
-    
-    /* Metrics styling */
-    [data-testid="stMetricValue"] {
-        font-size: 1.4rem;
-    }
-    
-    /* Compact spacing */
-    .stColumn {
-        padding: 0.25rem;
-    }
-    
-    /* Responsive adjustments */
-    @media (max-width: 768px) {
-        .stButton > button {
-            width: 100%;
-            margin-bottom: 0.5rem;
-        }
-        
-        .card {
-            padding: 0.9rem;
-        }
-        
-        .main .block-container {
-            padding-top: 1rem;
-            padding-left: 1rem;
-            padding-right: 1rem;
+def inject_styles():
+    """Link the stylesheet served from ./static (cached by the browser across reruns)"""
+    st.markdown(f'<link rel="stylesheet" href="{STYLESHEET_URL}">', unsafe_allow_html=True)
+
+# --- PROFILING ---
+@contextmanager
+def profile_stage(name):
+    """Add the time spent in a block to the current rerun's stage timings"""
+    if not PROFILE_MODE:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = st.session_state.setdefault('_profile_stages', {})
+        stages[name] = stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+def profiled(name):
+    """Decorator form of profile_stage for RPC helpers"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@st.cache_resource
+def get_cprofile_lock():
+    """Only one cProfile profiler may be active per process (sys.monitoring on 3.12+)"""
+    return threading.Lock()
+
+def run_profiled(fn):
+    """Run one rerun of fn, saving its stats to PROFILE_DIR and showing a readout"""
+    if not PROFILE_MODE:
+        return fn()
+
+    st.session_state['_profile_stages'] = {}
+    profiler = None
+    # While another session's rerun holds the profiler this one gets timer-only stats
+    if PROFILE_MODE == 'cprofile' and get_cprofile_lock().acquire(blocking=False):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            get_cprofile_lock().release()
+            profiler = None
+    start = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        total_ms = (time.perf_counter() - start) * 1000
+        if profiler is not None:
+            profiler.disable()
+            get_cprofile_lock().release()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        top = []
+        if profiler is not None:
+            import pstats
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"rerun_{stamp}.prof"))
+            stats = pstats.Stats(profiler)
+            ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:5]
+            top = [{'function': f"{func[2]} ({os.path.basename(func[0])}:{func[1]})",
+                    'ms': round(tottime * 1000, 1)}
+                   for func, (_, _, tottime, _, _) in ranked]
+        summary = {
+            'timestamp': stamp,
+            'total_ms': round(total_ms, 1),
+            'stages_ms': {k: round(v, 1) for k, v in st.session_state.get('_profile_stages', {}).items()},
+            'top_functions': top,
         }
-    }
-    
-    /* Divider styling */
-    hr {
-        margin: 0.5rem 0;
-        border: none;
-        height: 1px;
-        background: linear-gradient(to right, transparent, #e9ecef, transparent);
-    }
-</style>
-""", unsafe_allow_html=True)
+        with open(os.path.join(PROFILE_DIR, f"rerun_{stamp}.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        readout = f"⏱️ Last rerun: {summary['total_ms']:.0f} ms"
+        if summary['stages_ms']:
+            readout += " • " + ", ".join(f"{k} {v:.0f} ms" for k, v in summary['stages_ms'].items())
+        if top:
+            readout += " • top: " + ", ".join(f"{t['function']} {t['ms']:.0f} ms" for t in top[:3])
+        elif PROFILE_MODE == 'cprofile':
+            readout += " • cProfile busy in another session, timings only"
+        st.sidebar.caption(readout)
+
+# --- RPC RATE LIMITING ---
+class TokenBucket:
+    """Thread-safe token bucket; a rate of 0 disables limiting"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RpcGovernor:
+    """Process-wide read/write rate limits plus a cap on concurrent calls"""
+
+    WRITE_METHODS = {'create', 'write', 'unlink'}
+
+    def __init__(self, read_rate, write_rate, max_in_flight):
+        self.buckets = {'read': TokenBucket(read_rate), 'write': TokenBucket(write_rate)}
+        self.slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        self.lock = threading.Lock()
+        self.waiting = {'read': 0, 'write': 0}
+        self.calls = {'read': 0, 'write': 0}
+        self.waits = {'read': deque(maxlen=100), 'write': deque(maxlen=100)}
+        self.bytes = {'sent': 0, 'received': 0}
+
+    @contextmanager
+    def slot(self, method):
+        """Block until the call fits the budget, then hold an in-flight slot"""
+        kind = 'write' if method in self.WRITE_METHODS else 'read'
+        start = time.monotonic()
+        with self.lock:
+            self.waiting[kind] += 1
+        try:
+            self.buckets[kind].acquire()
+            if self.slots:
+                self.slots.acquire()
+        finally:
+            with self.lock:
+                self.waiting[kind] -= 1
+        with self.lock:
+            self.calls[kind] += 1
+            self.waits[kind].append(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            if self.slots:
+                self.slots.release()
+
+    def record_bytes(self, sent=0, received=0):
+        with self.lock:
+            self.bytes['sent'] += sent
+            self.bytes['received'] += received
+
+    def transfer(self):
+        """Bytes on the wire (after compression) since the process started"""
+        with self.lock:
+            return dict(self.bytes)
+
+    def snapshot(self):
+        """Current queue depth and recent wait times per budget"""
+        with self.lock:
+            return {
+                kind: {
+                    'waiting': self.waiting[kind],
+                    'calls': self.calls[kind],
+                    'avg_wait_ms': 1000 * sum(w) / len(w) if w else 0.0,
+                    'max_wait_ms': 1000 * max(w) if w else 0.0,
+                }
+                for kind, w in self.waits.items()
+            }
+
+@st.cache_resource
+def get_rpc_governor():
+    """Single governor shared by all sessions of this Streamlit process"""
+    return RpcGovernor(ODOO_READ_RATE, ODOO_WRITE_RATE, ODOO_MAX_IN_FLIGHT)
+
+@st.cache_resource
+def get_background_executor():
+    """Small shared pool for RPC work that should not block a rerun"""
+    return ThreadPoolExecutor(max_workers=4)
+
+class _CountingResponse:
+    """Wraps an HTTP response to count the bytes read from the wire"""
+
+    def __init__(self, response, governor):
+        self._response = response
+        self._governor = governor
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self._governor.record_bytes(received=len(data))
+        return data
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+class _CountingTransportMixin:
+    """Counts wire bytes and optionally gzips requests (gzip responses are the stdlib default)"""
+
+    def __init__(self, governor, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.governor = governor
+        if ODOO_GZIP_REQUEST_THRESHOLD >= 0:
+            self.encode_threshold = ODOO_GZIP_REQUEST_THRESHOLD
+
+    def send_content(self, connection, request_body):
+        # Same as Transport.send_content, but counts the body that actually goes out
+        if (self.encode_threshold is not None and
+                self.encode_threshold < len(request_body) and
+                xmlrpc.client.gzip):
+            connection.putheader("Content-Encoding", "gzip")
+            request_body = xmlrpc.client.gzip_encode(request_body)
+        self.governor.record_bytes(sent=len(request_body))
+        connection.putheader("Content-Length", str(len(request_body)))
+        connection.endheaders(request_body)
+
+    def parse_response(self, response):
+        return super().parse_response(_CountingResponse(response, self.governor))
+
+class CountingTransport(_CountingTransportMixin, xmlrpc.client.Transport):
+    pass
+
+class CountingSafeTransport(_CountingTransportMixin, xmlrpc.client.SafeTransport):
+    pass
+
+class GovernedModels:
+    """Drop-in for the object ServerProxy that routes execute_kw through the governor.
+
+    Each thread gets its own ServerProxy since they are not safe to share.
+    """
+
+    def __init__(self, url, governor):
+        self._url = url
+        self._governor = governor
+        self._local = threading.local()
+
+    def _proxy(self):
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            transport_cls = CountingSafeTransport if self._url.startswith('https') else CountingTransport
+            proxy = self._local.proxy = xmlrpc.client.ServerProxy(
+                self._url, transport=transport_cls(self._governor), allow_none=True
+            )
+        return proxy
+
+    def execute_kw(self, db, uid, password, model, method, *args):
+        with self._governor.slot(method):
+            return self._proxy().execute_kw(db, uid, password, model, method, *args)
 
 # --- ODOO CONNECTION FUNCTIONS ---
 @st.cache_resource
@@ -261,12 +372,12 @@ def get_odoo_connection(_uid, _password):
     try:
         common = xmlrpc.client.ServerProxy(f'{ODOO_URL}/xmlrpc/2/common')
         uid = common.authenticate(ODOO_DB, _uid, _password, {})
-        models = xmlrpc.client.ServerProxy(f'{ODOO_URL}/xmlrpc/2/object')
+        models = GovernedModels(f'{ODOO_URL}/xmlrpc/2/object', get_rpc_governor())
         return uid, models
     except Exception as e:
         return None, str(e)
 
-def fetch_companies(uid, models):
+def fetch_companies(uid, models, raise_errors=False):
     """Fetch companies from Odoo"""
     try:
         ids = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'res.company', 'search', [[]])
@@ -274,28 +385,95 @@ def fetch_companies(uid, models):
                                      [ids], {'fields': ['id', 'name']})
         return companies
     except Exception as e:
+        if raise_errors:
+            raise
         return []
 
-def fetch_target_products(uid, models, company_id):
-    """Fetch products with Cost=0 in the Target Store"""
+def zero_cost_domain(categ_ids=None):
+    """Domain for storable/consumable products with Cost=0"""
     domain = [
         ("type", "in", ["consu", "product"]),
         ("standard_price", "=", 0)
     ]
+    if categ_ids:
+        domain.append(("categ_id", "in", list(categ_ids)))
+    return domain
+
+def search_read_ids(uid, models, model, domain, kwargs):
+    """search_read returning many2one fields as bare ids instead of [id, name] pairs"""
+    try:
+        return models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, model, 'search_read', 
+                                [domain], dict(kwargs, load=''))
+    except xmlrpc.client.Fault as e:
+        # Servers whose search_read does not forward `load` get the default format
+        if 'load' not in str(e):
+            raise
+        return models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, model, 'search_read', 
+                                [domain], kwargs)
+
+@st.cache_resource
+def get_category_cache():
+    """Category id -> name, shared by all sessions of this process"""
+    return {}
+
+def fetch_category_names(uid, models, categ_ids):
+    """Resolve category ids to names, reading only the ids not cached yet"""
+    cache = get_category_cache()
+    missing = sorted({c for c in categ_ids if c and c not in cache})
+    if missing:
+        try:
+            rows = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.category', 'read', 
+                                    [missing], {'fields': ['display_name']})
+            cache.update({r['id']: r['display_name'] for r in rows})
+        except Exception as e:
+            st.error(f"Error fetching categories: {e}")
+    return {c: cache.get(c, '') for c in categ_ids if c}
+
+@profiled('overview')
+def fetch_zero_cost_overview(uid, models, companies):
+    """Count zero-cost products per category for each store via read_group"""
+    rows = []
+    try:
+        for company in companies:
+            context = {'allowed_company_ids': [company['id']]}
+            groups = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.product', 'read_group', 
+                                      [zero_cost_domain(), ['categ_id'], ['categ_id']], 
+                                      {'lazy': False, 'context': context})
+            for g in groups:
+                categ = g.get('categ_id')
+                rows.append({
+                    'store_id': company['id'],
+                    'Store': company['name'],
+                    'categ_id': categ[0] if categ else False,
+                    'Category': categ[1] if categ else 'Undefined',
+                    'Products': g.get('__count', g.get('categ_id_count', 0))
+                })
+        return rows
+    except Exception as e:
+        st.error(f"Error fetching overview: {e}")
+        return []
+
+@profiled('fetch')
+def fetch_target_products(uid, models, company_id, categ_ids=None, raise_errors=False):
+    """Fetch products with Cost=0 in the Target Store (optionally scoped to categories)"""
+    domain = zero_cost_domain(categ_ids)
     context = {'allowed_company_ids': [company_id]}
     
+    # standard_price is fixed to 0 by the domain; categories are named via fetch_category_names
     try:
-        products = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.product', 'search_read', 
-                                    [domain], 
-                                    {'fields': ['id', 'default_code', 'name', 'standard_price', 'categ_id'], 
-                                     'context': context, 
-                                     'limit': 10000})
+        products = search_read_ids(uid, models, 'product.product', domain, 
+                                   {'fields': ['default_code', 'name', 'categ_id', 'product_tmpl_id'], 
+                                    'context': context, 
+                                    'limit': 10000})
         return products
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Error fetching products: {e}")
         return []
 
-def fetch_reference_costs(uid, models, source_company_id, product_refs, product_names):
+@profiled('lookup')
+def fetch_reference_costs(uid, models, source_company_id, product_refs, product_names, raise_errors=False):
     """Fetch reference costs from source store"""
     context = {'allowed_company_ids': [source_company_id]}
     domain = ['|', ('default_code', 'in', product_refs), ('name', 'in', product_names)]
@@ -307,64 +485,593 @@ def fetch_reference_costs(uid, models, source_company_id, product_refs, product_
                                             'context': context})
         return source_products
     except Exception as e:
+        if raise_errors:
+            raise
         st.error(f"Error fetching reference costs: {e}")
         return []
 
-def update_product_cost(uid, models, product_id, new_cost, company_id):
-    """Update product cost in Odoo"""
+@profiled('update')
+def update_product_cost(uid, models, product_ids, new_cost, company_id, raise_errors=False):
+    """Update product cost in Odoo (one id or a list of ids sharing the cost)"""
+    if not isinstance(product_ids, list):
+        product_ids = [product_ids]
     try:
         context = {'allowed_company_ids': [company_id]}
         models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.product', 'write', 
-                         [[product_id], {'standard_price': new_cost}], 
+                         [product_ids, {'standard_price': new_cost}], 
                          {'context': context})
         return True, None
     except Exception as e:
+        if raise_errors:
+            raise
         return False, str(e)
 
+@profiled('verify')
+def fetch_current_costs(uid, models, product_ids, company_id, raise_errors=False):
+    """Re-read current costs for planned products in one call (None on failure)"""
+    context = {'allowed_company_ids': [company_id]}
+
+    try:
+        rows = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.product', 'search_read',
+                                [[('id', 'in', list(product_ids))]],
+                                {'fields': ['standard_price'],
+                                 'context': context})
+        return {r['id']: r['standard_price'] for r in rows}
+    except Exception as e:
+        if raise_errors:
+            raise
+        st.error(f"Error verifying current costs: {e}")
+        return None
+
+def cursor_domain(cursor):
+    """Keyset condition for records changed after a (write_date, id) cursor"""
+    if not cursor:
+        return []
+    write_date, last_id = cursor
+    return ['|', ('write_date', '>', write_date),
+            '&', ('write_date', '=', write_date), ('id', '>', last_id)]
+
+def until_domain(cursor):
+    """Keyset condition for records at or before a (write_date, id) cursor"""
+    if not cursor:
+        return []
+    write_date, last_id = cursor
+    return ['|', ('write_date', '<', write_date),
+            '&', ('write_date', '=', write_date), ('id', '<=', last_id)]
+
+def fetch_zero_cost_since(uid, models, company_id, cursor, limit, until=None):
+    """Fetch zero-cost products created/changed after the cursor (up to `until`), oldest first.
+
+    Errors are raised, not reported, so a failed poll is never mistaken for
+    "nothing new" by the caller.
+    """
+    context = {'allowed_company_ids': [company_id]}
+    domain = zero_cost_domain() + cursor_domain(cursor) + until_domain(until)
+    
+    return search_read_ids(uid, models, 'product.product', domain, 
+                           {'fields': ['default_code', 'name', 'product_tmpl_id', 'write_date'], 
+                            'context': context, 
+                            'order': 'write_date asc, id asc', 
+                            'limit': limit})
+
+def fetch_zero_cost_by_keys(uid, models, company_id, keys):
+    """Fetch zero-cost products whose SKU or name is one of keys (raises on error)"""
+    context = {'allowed_company_ids': [company_id]}
+    keys = list(keys)
+    domain = zero_cost_domain() + ['|', ('default_code', 'in', keys), ('name', 'in', keys)]
+    
+    return search_read_ids(uid, models, 'product.product', domain, 
+                           {'fields': ['default_code', 'name', 'product_tmpl_id', 'write_date'], 
+                            'context': context})
+
+def fetch_source_costs_since(uid, models, source_company_id, cursor, limit, until=None):
+    """Fetch source-store products with a cost, changed after the cursor (up to `until`),
+    oldest first (raises on error)"""
+    context = {'allowed_company_ids': [source_company_id]}
+    domain = [("standard_price", ">", 0)] + cursor_domain(cursor) + until_domain(until)
+    
+    return models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, 'product.product', 'search_read', 
+                            [domain], 
+                            {'fields': ['default_code', 'name', 'standard_price', 'write_date'], 
+                             'context': context, 
+                             'order': 'write_date asc, id asc', 
+                             'limit': limit})
+
+# --- UPDATE PLANNING ---
+def build_products_df(products, category_names=None):
+    """Turn fetched target products into the working DataFrame.
+
+    Many2one fields may come as [id, name] pairs or bare ids; bare category
+    ids are named through category_names.
+    """
+    import pandas as pd
+    
+    category_names = category_names or {}
+    df = pd.DataFrame(products)
+    if 'categ_id' in df.columns:
+        df['category'] = df['categ_id'].apply(
+            lambda x: x[1] if isinstance(x, list) else category_names.get(x, '') if x else ''
+        )
+    if 'product_tmpl_id' in df.columns:
+        df['tmpl_id'] = df['product_tmpl_id'].apply(
+            lambda x: x[0] if isinstance(x, list) else x or None
+        )
+    return df
+
+def build_cost_map(ref_data):
+    """Map SKU and name to the positive source-store cost"""
+    cost_map = {}
+    for item in ref_data:
+        price = item.get('standard_price', 0.0)
+        if price > 0:
+            if item.get('default_code'):
+                cost_map[item['default_code']] = price
+            cost_map[item['name']] = price
+    return cost_map
+
+def build_update_plan(target_batch, cost_map):
+    """Resolve the new cost for each selected row.
+
+    Returns (planned, unmatched): planned is a list of (idx, row, new_cost)
+    for rows with a reference cost, unmatched the rows without one.
+    """
+    planned = []
+    unmatched = []
+    for idx, row in target_batch.iterrows():
+        new_cost = cost_map.get(row['default_code'], cost_map.get(row['name'], 0.0))
+        if new_cost > 0:
+            planned.append((idx, row, new_cost))
+        else:
+            unmatched.append((idx, row))
+    return planned, unmatched
+
+def verify_update_plan(planned, current_costs):
+    """Drop rows whose live cost no longer needs a write.
+
+    Returns (to_write, dropped) where dropped maps idx -> status. A row is
+    dropped when its current cost already equals the new cost, when someone
+    else has set a non-zero cost since the fetch, or when it no longer exists.
+    If the live costs could not be read (None) nothing is written: every row
+    is dropped as not verified rather than risk overwriting a fixed cost.
+    """
+    if current_costs is None:
+        return [], {idx: "⚠️ Not Verified" for idx, _, _ in planned}
+
+    to_write = []
+    dropped = {}
+    for idx, row, new_cost in planned:
+        current = current_costs.get(int(row['id']))
+        if current is None:
+            dropped[idx] = "⚠️ Not Found"
+        elif math.isclose(current, new_cost, abs_tol=1e-6):
+            dropped[idx] = "⏭️ No Change"
+        elif current > 0:
+            dropped[idx] = "⏭️ Already Costed"
+        else:
+            to_write.append((idx, row, new_cost))
+    return to_write, dropped
+
+def group_writes_by_template(to_write):
+    """Group planned rows of the same template that share one new cost.
+
+    Returns a list of (new_cost, [(idx, row), ...]); each group becomes a
+    single write, so a template whose variants all resolve to the same cost
+    costs one RPC instead of one per variant. Rows without a template id
+    stay in groups of their own.
+    """
+    groups = {}
+    for idx, row, new_cost in to_write:
+        tmpl_id = row.get('tmpl_id')
+        if tmpl_id is None or tmpl_id != tmpl_id:  # None or NaN
+            key = ('product', int(row['id']))
+        else:
+            key = ('template', int(tmpl_id), new_cost)
+        groups.setdefault(key, (new_cost, []))[1].append((idx, row))
+    return list(groups.values())
+
+# --- REPORT EXPORT ---
+def unique_stamp():
+    """Timestamp plus a random suffix, so concurrent runs never share a file name"""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:8]}"
+
+def available_report_formats():
+    """Report formats usable in this environment (Parquet needs pyarrow)"""
+    return [f for f in REPORT_FORMATS
+            if f != 'Parquet' or importlib.util.find_spec('pyarrow') is not None]
+
+class ReportWriter:
+    """Append sync results to a report file while the sync runs.
+
+    CSV rows are flushed as they are written; Parquet rows are buffered and
+    written as row groups, so memory stays bounded by the batch size.
+    """
+
+    def __init__(self, fmt, batch_size=500):
+        ext, self.mime = REPORT_FORMATS[fmt]
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        self.path = os.path.join(REPORT_DIR, f"cost_sync_{unique_stamp()}.{ext}")
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self._buffer = []
+        if fmt == 'CSV':
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+            self._csv = csv.DictWriter(self._file, fieldnames=REPORT_COLUMNS)
+            self._csv.writeheader()
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self._pa = pa
+            self._schema = pa.schema([
+                ('product_id', pa.int64()),
+                ('sku', pa.string()),
+                ('product', pa.string()),
+                ('new_cost', pa.float64()),
+                ('status', pa.string()),
+            ])
+            self._parquet = pq.ParquetWriter(self.path, self._schema)
+
+    def write(self, product_id, sku, product, new_cost, status):
+        row = {'product_id': int(product_id), 'sku': sku or None, 'product': product,
+               'new_cost': float(new_cost), 'status': status}
+        if self.fmt == 'CSV':
+            self._csv.writerow(row)
+            self._file.flush()
+        else:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._flush_parquet()
+
+    def _flush_parquet(self):
+        if self._buffer:
+            table = self._pa.Table.from_pylist(self._buffer, schema=self._schema)
+            self._parquet.write_table(table)
+            self._buffer = []
+
+    def close(self):
+        if self.fmt == 'CSV':
+            self._file.close()
+        else:
+            self._flush_parquet()
+            self._parquet.close()
+
+def read_export(path):
+    """Read an exported report or plan from disk (called only when downloading)"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+# --- RUN HISTORY ---
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    source_company_id INTEGER,
+    source_company TEXT,
+    company_id INTEGER,
+    company TEXT,
+    items INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_items (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    ts TEXT NOT NULL,
+    company_id INTEGER,
+    product_id INTEGER NOT NULL,
+    sku TEXT,
+    product TEXT,
+    old_cost REAL,
+    new_cost REAL,
+    match_source TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_run_items_product ON run_items(product_id, ts);
+CREATE INDEX IF NOT EXISTS idx_run_items_sku ON run_items(sku, ts);
+CREATE INDEX IF NOT EXISTS idx_run_items_company ON run_items(company_id, ts);
+CREATE INDEX IF NOT EXISTS idx_run_items_sku_company ON run_items(sku, company_id, ts);
+CREATE INDEX IF NOT EXISTS idx_run_items_product_company ON run_items(product_id, company_id, ts);
+CREATE INDEX IF NOT EXISTS idx_run_items_ts ON run_items(ts);
+CREATE INDEX IF NOT EXISTS idx_runs_ts ON runs(ts);
+"""
+
+# Display statuses -> stable codes stored in history
+STATUS_CODES = {
+    "✅ Updated": 'updated',
+    "❌ Failed": 'failed',
+    "⚠️ No Reference": 'no_reference',
+    "⚠️ Not Found": 'not_found',
+    "⚠️ Not Verified": 'not_verified',
+    "⏭️ No Change": 'no_change',
+    "⏭️ Already Costed": 'already_costed',
+}
+
+@st.cache_resource
+def ensure_history_schema(path):
+    """Create the history tables once per process"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(HISTORY_SCHEMA)
+    conn.close()
+    return True
+
+def open_history():
+    """Short-lived connection to the history store (safe across sessions/threads)"""
+    ensure_history_schema(HISTORY_DB)
+    return sqlite3.connect(HISTORY_DB, timeout=30)
+
+def match_source(row, cost_map):
+    """Which key resolved the new cost: 'sku', 'name' or None"""
+    if row['default_code'] and cost_map.get(row['default_code'], 0) > 0:
+        return 'sku'
+    if cost_map.get(row['name'], 0) > 0:
+        return 'name'
+    return None
+
+def record_run(origin, source, company, items):
+    """Append one run and its per-product outcomes; returns the run id.
+
+    source/company are (id, name) pairs; items are dicts with product_id,
+    sku, product, old_cost, new_cost, match_source and status.
+    """
+    ts = datetime.now().isoformat(timespec='seconds')
+    try:
+        conn = open_history()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO runs (ts, origin, source_company_id, source_company, company_id, company, items) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ts, origin, source[0], source[1], company[0], company[1], len(items))
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO run_items (run_id, ts, company_id, product_id, sku, product, "
+                "old_cost, new_cost, match_source, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, ts, company[0], int(i['product_id']), i['sku'] or None, i['product'],
+                  i['old_cost'], i['new_cost'], i['match_source'],
+                  STATUS_CODES.get(i['status'], i['status'])) for i in items]
+            )
+        conn.close()
+        return run_id
+    except sqlite3.Error as e:
+        st.error(f"Error saving run history: {e}")
+        return None
+
+def query_history(sku=None, product_id=None, company_id=None, status=None, limit=200):
+    """Latest history rows matching the filters, newest first (index-backed, bounded by limit)"""
+    clauses, params = [], []
+    if sku:
+        clauses.append("i.sku = ?")
+        params.append(sku)
+    if product_id:
+        clauses.append("i.product_id = ?")
+        params.append(int(product_id))
+    if company_id:
+        clauses.append("i.company_id = ?")
+        params.append(company_id)
+    if status:
+        clauses.append("i.status = ?")
+        params.append(status)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = (
+        "SELECT i.ts, r.company, i.product_id, i.sku, i.product, i.old_cost, i.new_cost, "
+        "i.match_source, r.source_company, i.status, r.origin, i.run_id "
+        f"FROM run_items i JOIN runs r ON r.run_id = i.run_id {where} "
+        "ORDER BY i.ts DESC LIMIT ?"
+    )
+    conn = open_history()
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(r) for r in conn.execute(sql, params + [limit])]
+    finally:
+        conn.close()
+
+# --- UPDATE PLAN ARTIFACT ---
+def build_plan(target_batch, cost_map, source, target):
+    """Resolve selected rows into a self-contained, versioned update plan.
+
+    source/target are (id, name) pairs. The plan holds everything needed to
+    apply it later from another process: ids, old/new cost, match source.
+    """
+    planned, unmatched = build_update_plan(target_batch, cost_map)
+    return {
+        'version': PLAN_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'odoo_db': ODOO_DB,
+        'source_company': {'id': int(source[0]), 'name': source[1]},
+        'target_company': {'id': int(target[0]), 'name': target[1]},
+        'items': [{
+            'product_id': int(row['id']),
+            'sku': row['default_code'] or None,
+            'product': row['name'],
+            'old_cost': float(row.get('standard_price', 0.0)),
+            'new_cost': float(new_cost),
+            'match_source': match_source(row, cost_map),
+        } for _, row, new_cost in planned],
+        'unmatched': [{
+            'product_id': int(row['id']),
+            'sku': row['default_code'] or None,
+            'product': row['name'],
+        } for _, row in unmatched],
+    }
+
+def save_plan(plan, path=None):
+    """Write a plan as JSON (atomically); returns its path"""
+    if path is None:
+        os.makedirs(PLAN_DIR, exist_ok=True)
+        path = os.path.join(PLAN_DIR, f"plan_{plan['target_company']['id']}_{unique_stamp()}.json")
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return path
+
+def load_plan(path):
+    """Read a plan file, rejecting versions this code does not understand"""
+    with open(path, encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')!r} (expected {PLAN_VERSION})")
+    return plan
+
+def apply_plan(uid, models, plan, on_result=None, on_progress=None, raise_errors=False):
+    """Verify and write a plan in bulk; returns (statuses by product id, live costs or None).
+
+    Live costs are re-read in one call and rows that no longer need a write
+    are dropped; the rest are written with one call per distinct new cost
+    (chunked, a chunk the server rejects is bisected down to the failing ids).
+    on_result(item, status) fires per product as its outcome is known,
+    on_progress(done, total) after every chunk. A failed verification read
+    writes nothing: the rows are marked Not Verified, or with raise_errors
+    the error is raised.
+    """
+    company_id = plan['target_company']['id']
+    items = {i['product_id']: i for i in plan['items']}
+    statuses = {}
+    
+    for item in plan['unmatched']:
+        statuses[item['product_id']] = "⚠️ No Reference"
+        if on_result:
+            on_result(dict(item, new_cost=0.0), statuses[item['product_id']])
+    
+    current = fetch_current_costs(uid, models, list(items), company_id, raise_errors) if items else None
+    planned = [(pid, {'id': pid}, item['new_cost']) for pid, item in items.items()]
+    to_write, dropped = verify_update_plan(planned, current)
+    for pid, status in dropped.items():
+        statuses[pid] = status
+        if on_result:
+            on_result(items[pid], status)
+    
+    by_cost = {}
+    for pid, _, new_cost in to_write:
+        by_cost.setdefault(new_cost, []).append(pid)
+    
+    def attempt(ids, new_cost):
+        """True if written, False if the server rejected it, None on a transport error"""
+        try:
+            update_product_cost(uid, models, ids, new_cost, company_id, raise_errors=True)
+            return True
+        except xmlrpc.client.Fault:
+            return False
+        except Exception:
+            return None
+    
+    def settle(ids, ok):
+        for pid in ids:
+            statuses[pid] = "✅ Updated" if ok else "❌ Failed"
+            if on_result:
+                on_result(items[pid], statuses[pid])
+    
+    def write(ids, new_cost, ok):
+        # A rejected chunk is split in halves, so one locked or restricted
+        # record only fails itself. Splitting stops when both halves are
+        # rejected too (a bad cost or access rule fails every record) and on
+        # transport errors, so a chunk costs at most 1 + 2*log2(chunk) calls.
+        if ok or ok is None or len(ids) == 1:
+            settle(ids, bool(ok))
+            return
+        middle = len(ids) // 2
+        first, second = ids[:middle], ids[middle:]
+        first_ok = attempt(first, new_cost)
+        second_ok = attempt(second, new_cost) if first_ok is not None else None
+        if first_ok is False and second_ok is False:
+            settle(ids, False)
+            return
+        write(first, new_cost, first_ok)
+        write(second, new_cost, second_ok)
+    
+    total = len(to_write)
+    done = 0
+    for new_cost, ids in by_cost.items():
+        for start in range(0, len(ids), PLAN_WRITE_CHUNK):
+            chunk = ids[start:start + PLAN_WRITE_CHUNK]
+            write(chunk, new_cost, attempt(chunk, new_cost))
+            done += len(chunk)
+            if on_progress:
+                on_progress(done, total)
+    return statuses, current
+
+def plan_history_items(plan, statuses, current):
+    """History rows for an applied plan"""
+    rows = [dict(i, old_cost=(current or {}).get(i['product_id'], i['old_cost'])) for i in plan['items']]
+    rows += [dict(i, old_cost=0.0, new_cost=0.0, match_source=None) for i in plan['unmatched']]
+    return [dict(r, status=statuses[r['product_id']]) for r in rows if r['product_id'] in statuses]
+
 # --- LOGIN FUNCTION ---
 def login(username, password):
-    """Handle login authentication"""
+    """Handle login authentication (companies are loaded in the background)"""
     if username == APP_USERNAME and password == APP_PASSWORD:
         # Connect to Odoo after app login
         uid, models = get_odoo_connection(ODOO_USERNAME, ODOO_PASSWORD)
         if uid is None:
             return False, "Failed to connect to Odoo. Check credentials."
         
-        # Fetch companies
-        companies = fetch_companies(uid, models)
-        if not companies:
-            return False, "No companies found in Odoo"
-        
-        # Generate Map
-        company_map = {c['name']: c['id'] for c in companies}
-        
-        # Validate Source Store Exists
-        if SOURCE_STORE_NAME not in company_map:
-            return False, f"Source Store '{SOURCE_STORE_NAME}' not found in Odoo."
-            
         st.session_state.uid = uid
         st.session_state.models = models
-        st.session_state.companies = companies
         st.session_state.logged_in = True
         st.session_state.login_error = None
         
-        store_names = list(company_map.keys())
-        
-        # Set Source Store (Hardcoded)
-        st.session_state.source_store_name = SOURCE_STORE_NAME
-        st.session_state.source_store_id = company_map[SOURCE_STORE_NAME]
-        
-        # Set Default Target Store (First one that isn't the source)
-        available_targets = [name for name in store_names if name != SOURCE_STORE_NAME]
-        default_target = available_targets[0] if available_targets else SOURCE_STORE_NAME
-        
-        st.session_state.target_store_name = default_target
-        st.session_state.target_store_id = company_map.get(default_target)
+        # Fetch companies without holding up the login rerun
+        st.session_state.companies_future = get_background_executor().submit(fetch_companies, uid, models)
         
         return True, "Login successful"
     else:
         return False, "Invalid username or password"
 
+def apply_companies(companies):
+    """Set source/target stores from the fetched companies; returns an error or None"""
+    if not companies:
+        return "No companies found in Odoo"
+    
+    # Generate Map
+    company_map = {c['name']: c['id'] for c in companies}
+    
+    # Validate Source Store Exists
+    if SOURCE_STORE_NAME not in company_map:
+        return f"Source Store '{SOURCE_STORE_NAME}' not found in Odoo."
+    
+    st.session_state.companies = companies
+    store_names = list(company_map.keys())
+    
+    # Set Source Store (Hardcoded)
+    st.session_state.source_store_name = SOURCE_STORE_NAME
+    st.session_state.source_store_id = company_map[SOURCE_STORE_NAME]
+    
+    # Set Default Target Store (First one that isn't the source)
+    available_targets = [name for name in store_names if name != SOURCE_STORE_NAME]
+    default_target = available_targets[0] if available_targets else SOURCE_STORE_NAME
+    
+    st.session_state.target_store_name = default_target
+    st.session_state.target_store_id = company_map.get(default_target)
+    return None
+
+@st.fragment(run_every=0.25)
+def wait_for_companies():
+    """Placeholder that polls the background company fetch and reruns the app once it is done"""
+    future = st.session_state.get('companies_future')
+    if future is None or future.done():
+        st.rerun()
+    st.caption("⏳ Loading stores...")
+
+def ensure_companies_loaded():
+    """Apply the background company fetch started at login once it has finished.
+
+    Never blocks: while the fetch runs a polling placeholder is shown instead.
+    """
+    future = st.session_state.get('companies_future')
+    if future is None:
+        return
+    if not future.done():
+        wait_for_companies()
+        return
+    
+    companies = future.result()
+    st.session_state.companies_future = None
+    
+    error = apply_companies(companies)
+    if error:
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state.login_error = error
+        st.rerun()
+
 # --- LOGOUT FUNCTION ---
 def logout():
     """Handle logout"""
@@ -444,6 +1151,7 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    inject_styles()
     
     # Sidebar
     with st.sidebar:
@@ -508,6 +1216,18 @@ def main():
             else:
                 st.error("❌ **Not connected to Odoo**", icon="⚠️")
             
+            # Companies were requested in the background at login
+            ensure_companies_loaded()
+            
+            # Shared RPC budget usage
+            rpc = get_rpc_governor().snapshot()
+            transfer = get_rpc_governor().transfer()
+            st.caption(
+                f"RPC reads: {rpc['read']['waiting']} queued, avg wait {rpc['read']['avg_wait_ms']:.0f} ms • "
+                f"writes: {rpc['write']['waiting']} queued, avg wait {rpc['write']['avg_wait_ms']:.0f} ms • "
+                f"transferred: {transfer['sent'] / 1024:,.0f} KB sent, {transfer['received'] / 1024:,.0f} KB received"
+            )
+            
             st.markdown("---")
             
             # Store Configuration
@@ -554,8 +1274,13 @@ def main():
                     st.session_state.selected_products = set()
                     st.session_state.ref_cost_map = {}
                     st.session_state.results_df = None
+                    st.session_state.report_path = None
+                    st.session_state.plan_path = None
                     st.session_state.page_number = 1
                     st.session_state.key_version = 0
+                    st.session_state.overview_df = None
+                    st.session_state.scope_categ_ids = []
+                    get_category_cache().clear()
                     st.rerun()
             
             with col2:
@@ -581,7 +1306,14 @@ def main():
                     st.caption(f"{selected_count} of {total_count} selected")
 
     # Main content area logic
-    if st.session_state.logged_in:
+    if st.session_state.logged_in and st.session_state.companies_future is not None:
+        # Stores are still loading in the background (the sidebar polls for them)
+        st.markdown("## 🔄 Odoo Cost Synchronizer")
+        st.info("⏳ Loading stores from Odoo...")
+    elif st.session_state.logged_in:
+        # pandas is only needed once logged in; keeps the landing page light
+        import pandas as pd
+        
         # Main Header
         col1, col2 = st.columns([3, 1])
         with col1:
@@ -593,7 +1325,7 @@ def main():
                 st.metric("Products Loaded", len(st.session_state.products_df), delta=None)
         
         # Tabs
-        tab1, tab2 = st.tabs(["📋 Product Management", "🚀 Sync & Results"])
+        tab1, tab2, tab3 = st.tabs(["📋 Product Management", "🚀 Sync & Results", "🕘 History"])
         
         # TAB 1: PRODUCT MANAGEMENT
         with tab1:
@@ -602,6 +1334,41 @@ def main():
             with col2:
                 st.markdown("### Actions")
                 
+                # Overview Button (server-side counts, no product rows transferred)
+                if st.button("📊 **Zero-Cost Overview**", 
+                           width='stretch',
+                           help="Count zero-cost products per category in every store"):
+                    with st.spinner("Counting zero-cost products per store..."):
+                        targets = [c for c in st.session_state.companies 
+                                   if c['id'] != st.session_state.source_store_id]
+                        overview = fetch_zero_cost_overview(st.session_state.uid,
+                                                            st.session_state.models,
+                                                            targets)
+                        st.session_state.overview_df = pd.DataFrame(overview) if overview else None
+                        if not overview:
+                            st.warning("⚠️ No zero-cost products found in any store")
+                
+                # Category scope for the next fetch
+                if st.session_state.overview_df is not None:
+                    store_overview = st.session_state.overview_df[
+                        st.session_state.overview_df['store_id'] == st.session_state.target_store_id
+                    ]
+                    categ_labels = {
+                        row['categ_id']: f"{row['Category']} ({row['Products']})"
+                        for _, row in store_overview.iterrows() if row['categ_id']
+                    }
+                    # Drop stale picks from a previous overview before rendering
+                    st.session_state.scope_categ_ids = [
+                        cid for cid in st.session_state.scope_categ_ids if cid in categ_labels
+                    ]
+                    st.multiselect(
+                        "📁 Limit fetch to categories",
+                        options=list(categ_labels.keys()),
+                        format_func=lambda cid: categ_labels.get(cid, str(cid)),
+                        key="scope_categ_ids",
+                        help="Leave empty to fetch all categories"
+                    )
+                
                 # Fetch Products Button
                 if st.button("🔍 **Fetch Products**", 
                            type="primary", 
@@ -615,13 +1382,13 @@ def main():
                         with st.spinner(f"Fetching products from {st.session_state.target_store_name} (ID: {st.session_state.target_store_id})..."):
                             products = fetch_target_products(st.session_state.uid, 
                                                            st.session_state.models, 
-                                                           st.session_state.target_store_id)
+                                                           st.session_state.target_store_id,
+                                                           st.session_state.scope_categ_ids)
                             if products:
-                                df = pd.DataFrame(products)
-                                if 'categ_id' in df.columns:
-                                    df['category'] = df['categ_id'].apply(
-                                        lambda x: x[1] if isinstance(x, list) else ''
-                                    )
+                                categ_ids = {p['categ_id'] for p in products if isinstance(p.get('categ_id'), int)}
+                                df = build_products_df(products, fetch_category_names(st.session_state.uid,
+                                                                                      st.session_state.models,
+                                                                                      categ_ids))
                                 st.session_state.products_df = df
                                 st.session_state.selected_products = set()
                                 st.session_state.page_number = 1
@@ -640,6 +1407,15 @@ def main():
                         st.rerun()
             
             with col1:
+                # Zero-cost overview per category and store
+                if st.session_state.overview_df is not None:
+                    with st.expander("📊 Zero-Cost Overview", expanded=st.session_state.products_df is None):
+                        pivot = st.session_state.overview_df.pivot_table(
+                            index='Category', columns='Store', values='Products',
+                            aggfunc='sum', fill_value=0
+                        )
+                        st.dataframe(pivot, width='stretch', height=250)
+                
                 # Search and Filter
                 st.markdown("### Filter Products")
                 search_query = st.text_input(
@@ -654,13 +1430,14 @@ def main():
                     df = st.session_state.products_df
                     
                     # Apply search filter
-                    if search_query:
-                        filtered_df = df[
-                            df['name'].str.contains(search_query, case=False, na=False) |
-                            df['default_code'].astype(str).str.contains(search_query, case=False, na=False)
-                        ]
-                    else:
-                        filtered_df = df
+                    with profile_stage('filter'):
+                        if search_query:
+                            filtered_df = df[
+                                df['name'].str.contains(search_query, case=False, na=False) |
+                                df['default_code'].astype(str).str.contains(search_query, case=False, na=False)
+                            ]
+                        else:
+                            filtered_df = df
                     
                     # Bulk actions row
                     if not filtered_df.empty:
@@ -714,41 +1491,42 @@ def main():
                         st.markdown("---")
                         st.markdown(f"### Selected Products ({len(st.session_state.selected_products)})")
                         
-                        for original_idx, row in display_batch.iterrows():
-                            # Determine current state
-                            is_selected = original_idx in st.session_state.selected_products
+                        with profile_stage('render_cards'):
+                            for original_idx, row in display_batch.iterrows():
+                                # Determine current state
+                                is_selected = original_idx in st.session_state.selected_products
                             
-                            col1, col2 = st.columns([0.8, 9.2])
+                                col1, col2 = st.columns([0.8, 9.2])
                             
-                            with col1:
-                                # FIX: Versioned Key Logic to force re-render
-                                st.checkbox(
-                                    f"Select {row['name']}",
-                                    value=is_selected,
-                                    key=f"chk_{original_idx}_v{st.session_state.key_version}", # Dynamic Key
-                                    label_visibility="collapsed",
-                                    on_change=toggle_selection,
-                                    args=(original_idx,)
-                                )
+                                with col1:
+                                    # FIX: Versioned Key Logic to force re-render
+                                    st.checkbox(
+                                        f"Select {row['name']}",
+                                        value=is_selected,
+                                        key=f"chk_{original_idx}_v{st.session_state.key_version}", # Dynamic Key
+                                        label_visibility="collapsed",
+                                        on_change=toggle_selection,
+                                        args=(original_idx,)
+                                    )
                             
-                            with col2:
-                                category = row.get('category', 'N/A')
-                                price = float(row.get('standard_price', 0))
+                                with col2:
+                                    category = row.get('category', 'N/A')
+                                    price = float(row.get('standard_price', 0))
                                 
-                                st.markdown(f"""
-                                <div class="product-card {'selected' if is_selected else ''}">
-                                    <div style="font-weight: 600; font-size: 0.95rem; margin-bottom: 0.2rem; color: #333;">
-                                        {row['name']}
-                                    </div>
-                                    <div style="font-size: 0.8rem; color: #666;">
-                                        <span style="background: #f0f0f0; padding: 0.1rem 0.4rem; border-radius: 4px; margin-right: 0.5rem;">
-                                            SKU: <strong>{row['default_code'] or 'N/A'}</strong>
-                                        </span>
-                                        <span style="margin-right: 0.5rem;">📁 {category}</span>
-                                        <span style="color: #dc3545;">💰 ₹{price:,.2f}</span>
+                                    st.markdown(f"""
+                                    <div class="product-card {'selected' if is_selected else ''}">
+                                        <div style="font-weight: 600; font-size: 0.95rem; margin-bottom: 0.2rem; color: #333;">
+                                            {row['name']}
+                                        </div>
+                                        <div style="font-size: 0.8rem; color: #666;">
+                                            <span style="background: #f0f0f0; padding: 0.1rem 0.4rem; border-radius: 4px; margin-right: 0.5rem;">
+                                                SKU: <strong>{row['default_code'] or 'N/A'}</strong>
+                                            </span>
+                                            <span style="margin-right: 0.5rem;">📁 {category}</span>
+                                            <span style="color: #dc3545;">💰 ₹{price:,.2f}</span>
+                                        </div>
                                     </div>
-                                </div>
-                                """, unsafe_allow_html=True)
+                                    """, unsafe_allow_html=True)
                     else:
                         st.info("No products match your search criteria.")
                 else:
@@ -789,15 +1567,7 @@ def main():
                                                            st.session_state.source_store_id, 
                                                            refs, names)
                             
-                            # Build cost map
-                            cost_map = {}
-                            for item in ref_data:
-                                price = item.get('standard_price', 0.0)
-                                if price > 0:
-                                    if item.get('default_code'):
-                                        cost_map[item['default_code']] = price
-                                    cost_map[item['name']] = price
-                            
+                            cost_map = build_cost_map(ref_data)
                             st.session_state.ref_cost_map = cost_map
                             
                             # Calculate matches
@@ -814,6 +1584,28 @@ def main():
                         st.markdown("---")
                         st.markdown("### Step 2: Execute Updates")
                         
+                        # Plans can be reviewed and applied later with plan.py
+                        if st.button("💾 Save Update Plan",
+                                   width='stretch',
+                                   help="Write the resolved updates to a plan file to review or apply later"):
+                            plan = build_plan(
+                                target_batch,
+                                st.session_state.ref_cost_map,
+                                (st.session_state.source_store_id, st.session_state.source_store_name),
+                                (st.session_state.target_store_id, st.session_state.target_store_name)
+                            )
+                            st.session_state.plan_path = save_plan(plan)
+                            st.success(f"✅ Saved plan with **{len(plan['items'])}** updates "
+                                       f"(**{len(plan['unmatched'])}** without reference) to `{st.session_state.plan_path}`")
+                        
+                        st.radio(
+                            "Report format",
+                            options=available_report_formats(),
+                            key="report_format",
+                            horizontal=True,
+                            help="Results are written to this file while the sync runs"
+                        )
+                        
                         if st.button("🚀 **Execute Cost Updates**", 
                                    type="primary",
                                    width='stretch',
@@ -825,66 +1617,79 @@ def main():
                             status_text = st.empty()
                             results_container = st.container()
                             
-                            total = len(target_batch)
                             results = []
                             
                             with results_container:
-                                success = 0
-                                fail = 0
-                                skip = 0
+                                # Resolve once into a plan, then apply it in bulk
+                                plan = build_plan(
+                                    target_batch,
+                                    st.session_state.ref_cost_map,
+                                    (st.session_state.source_store_id, st.session_state.source_store_name),
+                                    (st.session_state.target_store_id, st.session_state.target_store_name)
+                                )
+                                
+                                # Stream results to disk as they are known
+                                report = ReportWriter(st.session_state.get('report_format', 'CSV'))
+                                try:
+                                    def on_result(item, status):
+                                        report.write(item['product_id'], item['sku'], item['product'], item['new_cost'], status)
+                                
+                                    def on_progress(done, write_total):
+                                        progress_bar.progress(done / write_total)
+                                        status_text.text(f"Processing {done}/{write_total}...")
+                                
+                                    status_text.text(f"Verifying current costs for {len(plan['items'])} products...")
+                                    statuses, current_costs = apply_plan(
+                                        st.session_state.uid,
+                                        st.session_state.models,
+                                        plan,
+                                        on_result=on_result,
+                                        on_progress=on_progress
+                                    )
+                                    if plan['items'] and current_costs is None:
+                                        st.warning("⚠️ Could not verify current costs; nothing was written (rows marked Not Verified)")
+                                
+                                    success = sum(1 for s in statuses.values() if s == "✅ Updated")
+                                    fail = sum(1 for s in statuses.values() if s == "❌ Failed")
+                                    already_set = sum(1 for s in statuses.values() if s.startswith("⏭️"))
+                                    skip = len(statuses) - success - fail - already_set
+                                
+                                    # Report in the original selection order
+                                    new_costs = {i['product_id']: i['new_cost'] for i in plan['items']}
+                                    for _, row in target_batch.iterrows():
+                                        p_name = row['name']
+                                        p_id = int(row['id'])
+                                        results.append({
+                                            'Product': p_name[:50] + ("..." if len(p_name) > 50 else ""),
+                                            'SKU': row['default_code'] or "N/A",
+                                            'New Cost': new_costs.get(p_id, 0.0),
+                                            'Status': statuses[p_id]
+                                        })
                                 
-                                for i, (idx, row) in enumerate(target_batch.iterrows()):
-                                    p_ref = row['default_code']
-                                    p_name = row['name']
-                                    p_id = int(row['id'])
-                                    
-                                    new_cost = st.session_state.ref_cost_map.get(
-                                        p_ref, 
-                                        st.session_state.ref_cost_map.get(p_name, 0.0)
+                                    record_run(
+                                        'app',
+                                        (st.session_state.source_store_id, st.session_state.source_store_name),
+                                        (st.session_state.target_store_id, st.session_state.target_store_name),
+                                        plan_history_items(plan, statuses, current_costs)
                                     )
-                                    
-                                    if new_cost > 0:
-                                        success_flag, error_msg = update_product_cost(
-                                            st.session_state.uid,
-                                            st.session_state.models,
-                                            p_id,
-                                            new_cost,
-                                            st.session_state.target_store_id
-                                        )
-                                        
-                                        if success_flag:
-                                            success += 1
-                                            status = "✅ Updated"
-                                        else:
-                                            fail += 1
-                                            status = f"❌ Failed"
-                                    else:
-                                        skip += 1
-                                        status = "⚠️ No Reference"
-                                    
-                                    results.append({
-                                        'Product': p_name[:50] + ("..." if len(p_name) > 50 else ""),
-                                        'SKU': p_ref or "N/A",
-                                        'New Cost': f"₹{new_cost:,.2f}",
-                                        'Status': status
-                                    })
-                                    
-                                    # Update progress
-                                    progress = (i + 1) / total
-                                    progress_bar.progress(progress)
-                                    status_text.text(f"Processing {i+1}/{total}...")
+                                finally:
+                                    # Always finish the file (a Parquet footer is written on close)
+                                    report.close()
                                 
                                 # Final results
+                                st.session_state.report_path = report.path
                                 progress_bar.empty()
                                 status_text.empty()
                                 
                                 # Display summary
-                                col1, col2, col3 = st.columns(3)
+                                col1, col2, col3, col4 = st.columns(4)
                                 with col1:
                                     st.metric("✅ Successful", success, delta=None)
                                 with col2:
-                                    st.metric("⚠️ Skipped", skip, delta=None)
+                                    st.metric("⏭️ Already Set", already_set, delta=None)
                                 with col3:
+                                    st.metric("⚠️ Skipped", skip, delta=None)
+                                with col4:
                                     st.metric("❌ Failed", fail, delta=None)
                                 
                                 # Save results
@@ -894,12 +1699,26 @@ def main():
                 with col2:
                     st.markdown("### Export")
                     
-                    if st.session_state.results_df is not None:
+                    report_path = st.session_state.report_path
+                    if report_path and os.path.exists(report_path):
+                        ext = os.path.splitext(report_path)[1].lstrip('.')
+                        mime = next((m for e, m in REPORT_FORMATS.values() if e == ext), 'application/octet-stream')
+                        # File is read only when the button is clicked
                         st.download_button(
                             label="📥 Download Report",
-                            data=st.session_state.results_df.to_csv(index=False).encode('utf-8'),
-                            file_name=f"cost_sync_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                            mime="text/csv",
+                            data=functools.partial(read_export, report_path),
+                            file_name=os.path.basename(report_path),
+                            mime=mime,
+                            width='stretch'
+                        )
+                    
+                    plan_path = st.session_state.plan_path
+                    if plan_path and os.path.exists(plan_path):
+                        st.download_button(
+                            label="📄 Download Plan",
+                            data=functools.partial(read_export, plan_path),
+                            file_name=os.path.basename(plan_path),
+                            mime="application/json",
                             width='stretch'
                         )
                     
@@ -916,12 +1735,76 @@ def main():
                         st.session_state.results_df,
                         width='stretch',
                         hide_index=True,
-                        height=300
+                        height=300,
+                        column_config={
+                            'New Cost': st.column_config.NumberColumn(format="₹%.2f")
+                        }
+                    )
+        
+        # TAB 3: RUN HISTORY
+        with tab3:
+            st.markdown("### 🕘 Run History")
+            # A form so the query runs only on Search, not on every rerun of the app
+            with st.form("history_form", border=False):
+                col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 1, 1], vertical_alignment="bottom")
+                with col1:
+                    history_query = st.text_input("SKU or Product ID", placeholder="e.g. WT-1234 or 5821",
+                                                  key="history_query")
+                with col2:
+                    store_options = {0: "All stores"}
+                    store_options.update({c['id']: c['name'] for c in st.session_state.companies})
+                    history_store = st.selectbox("Store", options=list(store_options.keys()),
+                                                 format_func=store_options.get, key="history_store")
+                with col3:
+                    status_options = {None: "Any status"}
+                    status_options.update({code: label for label, code in STATUS_CODES.items()})
+                    history_status = st.selectbox("Status", options=list(status_options.keys()),
+                                                  format_func=status_options.get, key="history_status")
+                with col4:
+                    history_limit = st.number_input("Rows", min_value=10, max_value=5000, value=200, step=50,
+                                                    key="history_limit")
+                with col5:
+                    history_search = st.form_submit_button("🔍 Search", width='stretch')
+            
+            if history_search:
+                query = history_query.strip()
+                try:
+                    history = query_history(
+                        sku=query if query and not query.isdigit() else None,
+                        product_id=int(query) if query.isdigit() else None,
+                        company_id=history_store or None,
+                        status=history_status,
+                        limit=int(history_limit)
                     )
+                    # A numeric query may also be a SKU
+                    if query.isdigit() and not history:
+                        history = query_history(sku=query, company_id=history_store or None,
+                                                status=history_status, limit=int(history_limit))
+                    st.session_state.history_rows = pd.DataFrame(history)
+                except sqlite3.Error as e:
+                    st.session_state.history_rows = None
+                    st.error(f"Error reading run history: {e}")
+            
+            history = st.session_state.history_rows
+            if history is None:
+                st.info("Set filters and press Search to look up past runs.")
+            elif history.empty:
+                st.info("No history matches these filters yet.")
+            else:
+                st.dataframe(
+                    history,
+                    width='stretch',
+                    hide_index=True,
+                    height=400,
+                    column_config={
+                        'old_cost': st.column_config.NumberColumn("Old Cost", format="₹%.2f"),
+                        'new_cost': st.column_config.NumberColumn("New Cost", format="₹%.2f")
+                    }
+                )
     # Landing page for non-logged in users
     else:
         show_landing_page()
 
 # Run the app
 if __name__ == "__main__":
-    main()
+    run_profiled(main)
@@ -0,0 +1,139 @@
+"""Cold-start and warm-rerun benchmark for app.py.
+
+Runs the landing page through Streamlit's AppTest in a fresh interpreter,
+then logs in against loadtest.FakeOdoo, fetches products (tabs, a page of
+product cards, the history tab) and times warm reruns of that page too.
+Fails (exit code 1) when any time exceeds its target.
+
+Warm reruns are gated on the script's own time, taken from the app's
+PROFILE_MODE=timer summaries: AppTest's wall time mostly measures its 1 ms
+sleep-polling loop and varies with the machine. Wall times are printed too.
+
+    python bench_startup.py [--runs 20] [--cold-target-ms 1500] [--warm-target-ms 50]
+                            [--logged-in-target-ms 100]
+
+Targets can also be set with COLD_START_TARGET_MS / WARM_RERUN_TARGET_MS /
+LOGGED_IN_RERUN_TARGET_MS.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def _warm_reruns(at, runs, profile_dir):
+    """Rerun `runs` times; returns (wall ms, script ms) lists"""
+    wall, script = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        wall.append((time.perf_counter() - start) * 1000)
+        if at.exception:
+            raise RuntimeError(f"app raised on rerun: {at.exception}")
+        # Summaries are named by timestamp, so the newest is this rerun's
+        with open(max(glob.glob(os.path.join(profile_dir, 'rerun_*.json')))) as f:
+            script.append(json.load(f)['total_ms'])
+    return wall, script
+
+
+def _summary(values):
+    return {'median': round(statistics.median(values), 1), 'max': round(max(values), 1)}
+
+
+def measure(runs):
+    """Measure in this process; call only from a fresh interpreter"""
+    from streamlit.testing.v1 import AppTest
+
+    import loadtest
+
+    # Fake Odoo without latency: reruns that make no RPC calls are what is timed
+    fake = loadtest.FakeOdoo(stores=3, products=200)
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    profile_dir = os.path.join(workdir, 'profiles')
+    os.environ.update({
+        'ODOO_URL': fake.serve(),
+        'ODOO_DB': 'bench',
+        'ODOO_USERNAME': 'bench',
+        'ODOO_PASSWORD': 'bench',
+        'APP_USERNAME': 'bench',
+        'APP_PASSWORD': 'bench',
+        'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+        'REPORT_DIR': os.path.join(workdir, 'reports'),
+        'PLAN_DIR': os.path.join(workdir, 'plans'),
+        'PROFILE_MODE': 'timer',
+        'PROFILE_DIR': profile_dir,
+    })
+
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+
+    start = time.perf_counter()
+    at.run()
+    cold_ms = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(f"app raised on first run: {at.exception}")
+
+    warm_wall, warm_script = _warm_reruns(at, runs, profile_dir)
+    pandas_loaded = 'pandas' in sys.modules
+
+    loadtest.login_apptest(at, 'bench', 'bench')
+    loadtest._button(at, '🔍').click().run()
+    if at.exception:
+        raise RuntimeError(f"app raised fetching products: {at.exception}")
+    logged_in_wall, logged_in_script = _warm_reruns(at, runs, profile_dir)
+    fake.shutdown()
+
+    return {
+        'cold_ms': round(cold_ms, 1),
+        'warm_script_ms': _summary(warm_script),
+        'warm_wall_ms': _summary(warm_wall),
+        'logged_in_script_ms': _summary(logged_in_script),
+        'logged_in_wall_ms': _summary(logged_in_wall),
+        'pandas_loaded': pandas_loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20, help="warm reruns to time")
+    parser.add_argument('--cold-target-ms', type=float,
+                        default=float(os.getenv('COLD_START_TARGET_MS', '1500')))
+    parser.add_argument('--warm-target-ms', type=float,
+                        default=float(os.getenv('WARM_RERUN_TARGET_MS', '50')))
+    parser.add_argument('--logged-in-target-ms', type=float,
+                        default=float(os.getenv('LOGGED_IN_RERUN_TARGET_MS', '100')))
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.runs)))
+        return 0
+
+    # A fresh interpreter so module import costs count towards the cold start
+    out = subprocess.run([sys.executable, __file__, '--child', '--runs', str(args.runs)],
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+
+    print(f"cold start:   {result['cold_ms']:.1f} ms (target {args.cold_target_ms:.0f} ms)")
+    for label, key, target in [('warm rerun:', 'warm', args.warm_target_ms),
+                               ('logged in:', 'logged_in', args.logged_in_target_ms)]:
+        script, wall = result[f'{key}_script_ms'], result[f'{key}_wall_ms']
+        print(f"{label:<13} {script['median']:.1f} ms median, {script['max']:.1f} ms max "
+              f"(target {target:.0f} ms; AppTest wall {wall['median']:.1f} ms median)")
+    print(f"pandas loaded on landing page: {result['pandas_loaded']}")
+
+    ok = (result['cold_ms'] <= args.cold_target_ms
+          and result['warm_script_ms']['median'] <= args.warm_target_ms
+          and result['logged_in_script_ms']['median'] <= args.logged_in_target_ms)
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""Multi-session load test for app.py against a local fake Odoo.
+
+Starts an in-process XML-RPC server that mimics the parts of Odoo the app
+uses (with configurable latency), then drives N concurrent sessions through
+login -> Fetch Products -> Select All -> Fetch Reference Costs -> Execute
+Cost Updates. Reports throughput, per-step tail latency and memory per
+session.
+
+Two modes:
+
+- ``apptest`` (default): every session runs the real UI through Streamlit's
+  AppTest in its own worker process (AppTest is not safe to share between
+  threads). Includes script rerun/render cost; RPC budgets are per worker.
+- ``engine``: every session is a thread in this process calling the same
+  app.py functions the UI uses, so the shared connection and RPC governor
+  are exercised exactly as in one Streamlit server.
+
+    python loadtest.py --mode engine --sessions 16 --products 2000 --latency-ms 40
+
+The app's RPC budgets (ODOO_READ_RATE, ODOO_WRITE_RATE, ODOO_MAX_IN_FLIGHT)
+are off by default; set them in the environment to test a given ceiling.
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+SOURCE_STORE_NAME = "Wedtree eStore Private Limited - HO"
+STEPS = ['login', 'fetch_products', 'select_all', 'fetch_reference', 'execute']
+
+
+# --- FAKE ODOO ---
+class _Handler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/xmlrpc/2/common', '/xmlrpc/2/object')
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadedServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeOdoo:
+    """Just enough of Odoo's external API for the app's call sites"""
+
+    def __init__(self, stores=3, products=500, categories=10, variants=4,
+                 ref_ratio=0.8, latency_ms=0.0, jitter_ms=0.0, persist_writes=False):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.persist_writes = persist_writes
+        self.calls = 0
+        self.lock = threading.Lock()
+
+        self.companies = [{'id': 1, 'name': SOURCE_STORE_NAME}]
+        self.companies += [{'id': i + 2, 'name': f"Store {i + 1}"} for i in range(stores)]
+        self.categories = {c + 1: f"All / Category {c + 1}" for c in range(categories)}
+
+        # Products are shared; cost is company dependent like in Odoo
+        self.products = {}
+        self.costs = {}
+        for i in range(products):
+            pid = i + 1
+            categ = (i % categories) + 1
+            tmpl = i // variants + 1
+            self.products[pid] = {
+                'id': pid,
+                'default_code': f"SKU{pid:06d}",
+                'name': f"Product {pid}",
+                'type': 'product',
+                'categ_id': [categ, self.categories[categ]],
+                'product_tmpl_id': [tmpl, f"Template {tmpl}"],
+                'write_date': '2024-01-01 00:00:00',
+            }
+            ho_cost = round(100 + (tmpl % 50) * 10.0, 2) if random.random() < ref_ratio else 0.0
+            self.costs[(1, pid)] = ho_cost
+            for company in self.companies[1:]:
+                self.costs[(company['id'], pid)] = 0.0
+
+    # -- server plumbing --
+    def serve(self, host='127.0.0.1', port=0):
+        server = _ThreadedServer((host, port), requestHandler=_Handler,
+                                 allow_none=True, logRequests=False)
+        server.register_function(self.authenticate, 'authenticate')
+        server.register_function(self.execute_kw, 'execute_kw')
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.server = server
+        return f"http://{host}:{server.server_address[1]}"
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def _sleep(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    # -- API --
+    def authenticate(self, db, login, password, env):
+        self._sleep()
+        return 2
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        kwargs = kwargs or {}
+        self._sleep()
+        with self.lock:
+            self.calls += 1
+        company_id = (kwargs.get('context') or {}).get('allowed_company_ids', [1])[0]
+
+        if model == 'res.company':
+            if method == 'search':
+                return [c['id'] for c in self.companies]
+            if method in ('read', 'search_read'):
+                return [dict(c) for c in self.companies]
+        if model == 'product.category' and method == 'read':
+            return [{'id': cid, 'display_name': self.categories[cid]} for cid in args[0] if cid in self.categories]
+        if model == 'product.product':
+            if method == 'search_read':
+                return self._search_read(company_id, args[0], kwargs)
+            if method == 'read_group':
+                return self._read_group(company_id, args[0])
+            if method == 'write':
+                ids, vals = args
+                if self.persist_writes and 'standard_price' in vals:
+                    for pid in ids:
+                        self.costs[(company_id, pid)] = vals['standard_price']
+                return True
+        raise ValueError(f"fake Odoo does not implement {model}.{method}")
+
+    def _record(self, company_id, pid):
+        return dict(self.products[pid], standard_price=self.costs[(company_id, pid)])
+
+    def _match(self, record, domain):
+        """Evaluate a prefix-notation domain with '|'/'&' and =, !=, >, >=, <, <=, in"""
+        stack = []
+        for term in reversed(domain):
+            if term == '|':
+                a, b = stack.pop(), stack.pop()
+                stack.append(a or b)
+            elif term == '&':
+                a, b = stack.pop(), stack.pop()
+                stack.append(a and b)
+            else:
+                field, op, value = term
+                current = record.get(field)
+                if isinstance(current, list):
+                    current = current[0]
+                stack.append({
+                    '=': lambda: current == value,
+                    '!=': lambda: current != value,
+                    '>': lambda: current > value,
+                    '>=': lambda: current >= value,
+                    '<': lambda: current < value,
+                    '<=': lambda: current <= value,
+                    'in': lambda: current in value,
+                }[op]())
+        return all(stack)
+
+    def _search(self, company_id, domain):
+        return [r for r in (self._record(company_id, pid) for pid in self.products)
+                if self._match(r, domain)]
+
+    def _search_read(self, company_id, domain, kwargs):
+        records = self._search(company_id, domain)
+        if kwargs.get('order', '').startswith('write_date'):
+            records.sort(key=lambda r: (r['write_date'], r['id']))
+        if kwargs.get('limit'):
+            records = records[:kwargs['limit']]
+        fields = kwargs.get('fields')
+        if fields:
+            records = [{k: r[k] for k in ['id'] + fields if k in r} for r in records]
+        if kwargs.get('load') == '':
+            records = [{k: v[0] if isinstance(v, list) else v for k, v in r.items()} for r in records]
+        return records
+
+    def _read_group(self, company_id, domain):
+        counts = {}
+        for r in self._search(company_id, domain):
+            counts[r['categ_id'][0]] = counts.get(r['categ_id'][0], 0) + 1
+        return [{'categ_id': [cid, self.categories[cid]], 'categ_id_count': n}
+                for cid, n in sorted(counts.items())]
+
+
+# --- SESSION DRIVERS ---
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+@contextmanager
+def _timed(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = (time.perf_counter() - start) * 1000
+
+
+def _button(at, prefix):
+    return next(b for b in at.button if b.label.startswith(prefix))
+
+
+def login_apptest(at, username, password, timeout=30):
+    """Log an AppTest session in and rerun until the background store fetch is applied"""
+    at.text_input(key='login_user').input(username)
+    at.text_input(key='login_pass').input(password)
+    _button(at, 'Login').click().run()
+    deadline = time.monotonic() + timeout
+    while at.session_state['companies_future'] is not None:
+        if time.monotonic() > deadline:
+            raise TimeoutError("stores did not load after login")
+        time.sleep(0.01)
+        at.run()
+
+
+def _warm_apptest(timeout):
+    """Import and compile once per worker so sessions only pay for the flow"""
+    from streamlit.testing.v1 import AppTest
+    AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+
+
+def run_apptest_session(timeout):
+    """Drive the UI of one session; returns (step timings in ms, memory in MB)"""
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    before_mb = _rss_mb()
+
+    def step(name, action):
+        with _timed(timings, name):
+            action()
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+
+    step('login', lambda: login_apptest(at, os.environ['APP_USERNAME'], os.environ['APP_PASSWORD'], timeout))
+    step('fetch_products', lambda: _button(at, '🔍').click().run())
+    step('select_all', lambda: _button(at, '✅ Select All').click().run())
+    step('fetch_reference', lambda: _button(at, '📥').click().run())
+    step('execute', lambda: at.button(key='execute_updates').click().run())
+    return timings, _rss_mb() - before_mb
+
+
+def run_engine_session(app):
+    """Run one session's flow through the app's functions; returns (timings, None)"""
+    timings = {}
+
+    with _timed(timings, 'login'):
+        uid, models = app.get_odoo_connection(app.ODOO_USERNAME, app.ODOO_PASSWORD)
+        companies = app.fetch_companies(uid, models)
+        source_id = next(c['id'] for c in companies if c['name'] == app.SOURCE_STORE_NAME)
+        target = next(c for c in companies if c['id'] != source_id)
+        target_id = target['id']
+
+    with _timed(timings, 'fetch_products'):
+        df = app.build_products_df(app.fetch_target_products(uid, models, target_id))
+
+    with _timed(timings, 'select_all'):
+        target_batch = df.loc[df.index.tolist()]
+
+    with _timed(timings, 'fetch_reference'):
+        refs = target_batch['default_code'].dropna().unique().tolist()
+        names = target_batch['name'].unique().tolist()
+        cost_map = app.build_cost_map(app.fetch_reference_costs(uid, models, source_id, refs, names))
+
+    with _timed(timings, 'execute'):
+        # Same plan and bulk-write path as the app's Execute button
+        plan = app.build_plan(target_batch, cost_map, (source_id, SOURCE_STORE_NAME),
+                              (target_id, target['name']))
+        statuses, _ = app.apply_plan(uid, models, plan, raise_errors=True)
+        failed = sum(1 for s in statuses.values() if s == "❌ Failed")
+        if failed:
+            raise RuntimeError(f"execute: {failed} writes failed")
+    return timings, None
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['apptest', 'engine'], default='apptest')
+    parser.add_argument('--sessions', type=int, default=4, help="concurrent sessions")
+    parser.add_argument('--rounds', type=int, default=1, help="flows per session")
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="fake Odoo latency per call")
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help="AppTest timeout per step (s)")
+    args = parser.parse_args()
+
+    fake = FakeOdoo(stores=args.stores, products=args.products,
+                    latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    os.environ.update({
+        'ODOO_URL': fake.serve(),
+        'ODOO_DB': 'loadtest',
+        'ODOO_USERNAME': 'loadtest',
+        'ODOO_PASSWORD': 'loadtest',
+        'APP_USERNAME': 'loadtest',
+        'APP_PASSWORD': 'loadtest',
+        # Keep fake runs out of the real reports, plans and run history
+        'REPORT_DIR': os.path.join(workdir, 'reports'),
+        'PLAN_DIR': os.path.join(workdir, 'plans'),
+        'HISTORY_DB': os.path.join(workdir, 'history.sqlite3'),
+    })
+    total_flows = args.sessions * args.rounds
+
+    if args.mode == 'engine':
+        sys.path.insert(0, os.path.dirname(APP_PATH))
+        import app
+        pool = ThreadPoolExecutor(max_workers=args.sessions)
+        submit = lambda: pool.submit(run_engine_session, app)
+    else:
+        # AppTest replaces __main__ in the workers, so pickle the task
+        # functions by this module's importable name instead
+        import loadtest
+        # Workers inherit the environment set above
+        pool = ProcessPoolExecutor(max_workers=args.sessions, initializer=loadtest._warm_apptest,
+                                   initargs=(args.timeout,))
+        list(pool.map(time.sleep, [0] * args.sessions))  # start and warm every worker
+        submit = lambda: pool.submit(loadtest.run_apptest_session, args.timeout)
+
+    baseline_mb = _rss_mb()
+    results, memory, errors = [], [], []
+    start = time.perf_counter()
+    with pool:
+        futures = [submit() for _ in range(total_flows)]
+        for future in futures:
+            try:
+                timings, mem_mb = future.result()
+                results.append(timings)
+                if mem_mb is not None:
+                    memory.append(mem_mb)
+            except Exception as e:
+                errors.append(str(e))
+    elapsed = time.perf_counter() - start
+    if args.mode == 'engine':
+        memory = [(_rss_mb() - baseline_mb) / max(1, total_flows)]
+    fake.shutdown()
+
+    print(f"mode: {args.mode}, sessions: {args.sessions} concurrent x {args.rounds} rounds, "
+          f"{args.products} products, {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms latency")
+    print(f"completed: {len(results)}, failed: {len(errors)} in {elapsed:.1f} s")
+    print(f"throughput: {len(results) / elapsed:.2f} flows/s, {fake.calls / elapsed:.1f} RPC calls/s")
+    if results:
+        print(f"{'step':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name in STEPS + ['total']:
+            values = [sum(r.values()) if name == 'total' else r[name] for r in results]
+            print(f"{name:<16}{statistics.median(values):>10.0f}{_pct(values, 0.95):>10.0f}"
+                  f"{_pct(values, 0.99):>10.0f}{max(values):>10.0f}")
+    if args.mode == 'engine':
+        transfer = app.get_rpc_governor().transfer()
+        print(f"transferred: {transfer['sent'] / 1e3:,.0f} KB sent, {transfer['received'] / 1e3:,.0f} KB received "
+              f"({transfer['received'] / 1e3 / max(1, len(results)):,.1f} KB received per flow)")
+    if memory:
+        print(f"memory per session: {statistics.median(memory):.1f} MB median, {max(memory):.1f} MB max")
+    print(f"reports and run history: {workdir}")
+    for error in errors[:5]:
+        print(f"error: {error}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
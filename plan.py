@@ -0,0 +1,135 @@
+"""Create update plans off-peak and apply them later in bulk.
+
+    python plan.py create --store "Store 1" [--categories 4,7] [--out plan.json]
+    python plan.py apply plans/plan_5_20240101_020000_123456_1a2b3c4d.json [--dry-run] [--report-format Parquet]
+
+`create` does the heavy work (fetching zero-cost products and resolving
+reference costs) and writes a versioned JSON plan. `apply` can run from
+another process or machine: it re-reads live costs in one call, drops rows
+that no longer need a write, writes the rest with one call per distinct
+cost, streams a report and records the run in the history store.
+
+Any Odoo error while fetching or verifying aborts with exit code 2 before
+anything is written; failed writes exit with 1.
+"""
+import argparse
+import sys
+
+import app
+
+
+def connect():
+    uid, models = app.get_odoo_connection(app.ODOO_USERNAME, app.ODOO_PASSWORD)
+    if not uid:
+        raise SystemExit(f"Failed to connect to Odoo: {models if uid is None else 'invalid credentials'}")
+    return uid, models
+
+
+def abort(what, error):
+    """Stop with exit code 2 (the app's helpers report errors in the UI, so the CLI raises them)"""
+    print(f"Error {what}: {error}", file=sys.stderr)
+    raise SystemExit(2)
+
+
+def create(args):
+    uid, models = connect()
+    try:
+        companies = {c['name']: c['id'] for c in app.fetch_companies(uid, models, raise_errors=True)}
+    except Exception as e:
+        abort("fetching companies", e)
+    if app.SOURCE_STORE_NAME not in companies:
+        raise SystemExit(f"Source Store '{app.SOURCE_STORE_NAME}' not found in Odoo.")
+    if args.store not in companies:
+        raise SystemExit(f"Target store '{args.store}' not found in Odoo.")
+    source = (companies[app.SOURCE_STORE_NAME], app.SOURCE_STORE_NAME)
+    target = (companies[args.store], args.store)
+
+    categ_ids = [int(c) for c in args.categories.split(',')] if args.categories else None
+    try:
+        products = app.fetch_target_products(uid, models, target[0], categ_ids, raise_errors=True)
+    except Exception as e:
+        abort("fetching products", e)
+    if not products:
+        print("No products found with zero cost")
+        return 0
+    df = app.build_products_df(products)
+
+    refs = df['default_code'].dropna().unique().tolist()
+    names = df['name'].unique().tolist()
+    try:
+        ref_data = app.fetch_reference_costs(uid, models, source[0], refs, names, raise_errors=True)
+    except Exception as e:
+        abort("fetching reference costs", e)
+    cost_map = app.build_cost_map(ref_data)
+
+    plan = app.build_plan(df, cost_map, source, target)
+    path = app.save_plan(plan, args.out)
+    print(f"Saved plan with {len(plan['items'])} updates ({len(plan['unmatched'])} without reference) to {path}")
+    return 0
+
+
+def apply(args):
+    plan = app.load_plan(args.path)
+    target = plan['target_company']
+    print(f"Plan from {plan['created_at']}: {len(plan['items'])} updates, "
+          f"{len(plan['unmatched'])} without reference, target {target['name']} (ID {target['id']})")
+    if plan['odoo_db'] != app.ODOO_DB and not args.force:
+        raise SystemExit(f"Plan was made for database '{plan['odoo_db']}', not '{app.ODOO_DB}' (use --force)")
+    if args.dry_run:
+        return 0
+
+    uid, models = connect()
+    report = app.ReportWriter(args.report_format)
+
+    def on_result(item, status):
+        report.write(item['product_id'], item['sku'], item['product'], item['new_cost'], status)
+
+    def on_progress(done, total):
+        print(f"\rWriting {done}/{total}...", end='', flush=True)
+
+    try:
+        statuses, current = app.apply_plan(uid, models, plan, on_result=on_result, on_progress=on_progress,
+                                           raise_errors=True)
+    except Exception as e:
+        # Write failures are reported per product; an Odoo error here comes
+        # from the verification read, which runs before any write
+        abort("applying plan", e)
+    finally:
+        report.close()
+    print()
+
+    source = plan['source_company']
+    app.record_run('plan', (source['id'], source['name']), (target['id'], target['name']),
+                   app.plan_history_items(plan, statuses, current))
+
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    print(", ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
+    print(f"Report: {report.path}")
+    return 1 if counts.get("❌ Failed") else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_create = sub.add_parser('create', help="resolve reference costs into a plan file")
+    p_create.add_argument('--store', required=True, help="target store name")
+    p_create.add_argument('--categories', help="comma-separated product.category ids to limit the fetch")
+    p_create.add_argument('--out', help="plan path (default: PLAN_DIR/plan_<store id>_<timestamp>.json)")
+    p_create.set_defaults(func=create)
+
+    p_apply = sub.add_parser('apply', help="apply a plan file in bulk")
+    p_apply.add_argument('path')
+    p_apply.add_argument('--dry-run', action='store_true', help="only show what the plan contains")
+    p_apply.add_argument('--force', action='store_true', help="apply even if the plan names another database")
+    p_apply.add_argument('--report-format', choices=app.available_report_formats(), default='CSV')
+    p_apply.set_defaults(func=apply)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""Continuous auto-sync for newly created zero-cost products.
+
+Polls every target store for zero-cost products created or changed since a
+(write_date, id) cursor, resolves them against a cached map of source-store
+costs and writes the updates in small batches. Each poll costs two
+search_reads per store (new rows and the overlap re-scan) plus two for
+source-store changes, and one more per store while source lookups are
+queued, regardless of catalog size; writes are grouped per template like
+in the app.
+
+    python watcher.py [--interval 60] [--batch-size 50] [--since "2024-01-01 00:00:00"] [--once]
+
+Products that had no source cost when first seen are not kept in memory:
+when a source product gets a cost, its SKU and name are queued per store
+and the store's zero-cost products are looked up by them.
+
+Cursors (per store and for the source), queued lookups and failed writes
+are kept in WATCH_STATE_FILE so a restart or a --once run resumes where it
+stopped; source changes made while the watcher was down are caught up on
+start. Every poll also re-scans WATCH_OVERLAP seconds (default 300) behind
+each cursor for rows committed late by long transactions. Every poll that
+touches products is appended to the run history. A store whose poll fails
+keeps its cursor and queue; products whose write fails are retried on
+every poll.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import app
+
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '60'))
+WATCH_BATCH_SIZE = int(os.getenv('WATCH_BATCH_SIZE', '50'))
+WATCH_STATE_FILE = os.getenv('WATCH_STATE_FILE', 'watcher_state.json')
+SOURCE_PAGE_SIZE = 2000
+# Odoo stamps write_date at transaction start, so a long transaction (a bulk
+# import) can commit rows dated behind the cursor; each poll re-scans this many
+# seconds behind it
+WATCH_OVERLAP = float(os.getenv('WATCH_OVERLAP', '300'))
+LOOKUP_BATCH_SIZE = 500  # source SKUs/names looked up per store per poll
+MAX_RETRY = 5000
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def source_keys(rows):
+    """SKUs and names of source rows, as matched by build_cost_map"""
+    keys = set()
+    for row in rows:
+        if row.get('default_code'):
+            keys.add(row['default_code'])
+        keys.add(row['name'])
+    return keys
+
+
+def overlap_start(cursor):
+    """Cursor WATCH_OVERLAP seconds behind the given one"""
+    start = datetime.strptime(cursor[0][:19], '%Y-%m-%d %H:%M:%S') - timedelta(seconds=WATCH_OVERLAP)
+    return (start.strftime('%Y-%m-%d %H:%M:%S'), 0)
+
+
+class SeenWindow:
+    """Rows already processed inside the overlap window, so a re-scan only yields late commits"""
+
+    def __init__(self, seen=None):
+        self.seen = dict(seen or {})  # id -> write_date
+
+    def unseen(self, rows):
+        return [r for r in rows if self.seen.get(r['id']) != r['write_date']]
+
+    def add(self, rows):
+        for row in rows:
+            self.seen[row['id']] = row['write_date']
+
+    def prune(self, cursor):
+        if cursor:
+            start = overlap_start(cursor)[0]
+            self.seen = {pid: wd for pid, wd in self.seen.items() if wd >= start}
+
+
+class SourceCostCache:
+    """Source-store cost map, loaded once and then kept current by write_date"""
+
+    def __init__(self, uid, models, source_id):
+        self.uid = uid
+        self.models = models
+        self.source_id = source_id
+        self.cost_map = {}
+        self.cursor = None
+        self.window = SeenWindow()
+
+    def refresh(self):
+        """Pull source products changed since the last refresh; returns the changed rows"""
+        changed = []
+        while True:
+            rows = app.fetch_source_costs_since(self.uid, self.models, self.source_id,
+                                                self.cursor, SOURCE_PAGE_SIZE)
+            if not rows:
+                break
+            self.cost_map.update(app.build_cost_map(rows))
+            self.cursor = (rows[-1]['write_date'], rows[-1]['id'])
+            self.window.add(rows)
+            changed.extend(rows)
+            if len(rows) < SOURCE_PAGE_SIZE:
+                break
+        if self.cursor:
+            late = self.window.unseen(app.fetch_source_costs_since(
+                self.uid, self.models, self.source_id, overlap_start(self.cursor), None, until=self.cursor))
+            self.cost_map.update(app.build_cost_map(late))
+            self.window.add(late)
+            self.window.prune(self.cursor)
+            changed.extend(late)
+        return changed
+
+
+class CompanyWatcher:
+    """Cursor, queued source lookups and failed products for one target store"""
+
+    def __init__(self, company, cursor):
+        self.company = company
+        self.cursor = cursor
+        self.window = SeenWindow()
+        self.lookup = set()  # source SKUs/names that got a cost since the last lookup
+        self.retry = {}  # product id -> row whose verification or write failed
+
+    def _remember_retry(self, rows):
+        for row in rows:
+            self.retry[int(row['id'])] = row
+        while len(self.retry) > MAX_RETRY:
+            self.retry.pop(next(iter(self.retry)))
+
+    def poll(self, uid, models, cost_map, batch_size, source):
+        """Process one batch; returns (stats, more_work_queued).
+
+        Fetch errors propagate and leave the cursor and lookup queue as they
+        were. Products whose verification or write fails are retried on
+        every poll.
+        """
+        rows = app.fetch_zero_cost_since(uid, models, self.company['id'], self.cursor, batch_size)
+        next_cursor = (rows[-1]['write_date'], rows[-1]['id']) if rows else self.cursor
+        full = len(rows) >= batch_size
+        # Rows committed late behind the cursor; already-costed ones drop out by the domain
+        rows += self.window.unseen(app.fetch_zero_cost_since(
+            uid, models, self.company['id'], overlap_start(self.cursor), None, until=self.cursor))
+        lookup_keys = sorted(self.lookup)[:LOOKUP_BATCH_SIZE]
+        looked_up = (app.fetch_zero_cost_by_keys(uid, models, self.company['id'], lookup_keys)
+                     if lookup_keys else [])
+
+        candidates = {r['id']: r for r in rows}
+        for pid, row in self.retry.items():
+            candidates.setdefault(pid, row)
+        for row in looked_up:
+            candidates.setdefault(row['id'], row)
+
+        stats = {'new': len(rows), 'retried': len(self.retry), 'looked_up': len(looked_up),
+                 'updated': 0, 'already_set': 0, 'unmatched': 0, 'failed': 0}
+
+        def done():
+            self.cursor = next_cursor
+            self.window.add(rows)
+            self.window.prune(self.cursor)
+            self.lookup.difference_update(lookup_keys)
+            return stats, full or bool(self.lookup)
+
+        if not candidates:
+            return done()
+
+        df = app.build_products_df(list(candidates.values()))
+        planned, unmatched = app.build_update_plan(df, cost_map)
+        for pid in candidates:
+            self.retry.pop(pid, None)
+        stats['unmatched'] = len(unmatched)
+
+        # History: every planned row plus unmatched rows seen for the first time
+        new_ids = {r['id'] for r in rows}
+        statuses = {idx: "⚠️ No Reference" for idx, row in unmatched if int(row['id']) in new_ids}
+        current = None
+        if planned:
+            current = app.fetch_current_costs(uid, models, [int(row['id']) for _, row, _ in planned],
+                                              self.company['id'])
+            if current is None:
+                # Never write unverified; try the whole batch again next poll
+                self._remember_retry([candidates[int(row['id'])] for _, row, _ in planned])
+                stats['failed'] = len(planned)
+                log(f"{self.company['name']}: could not verify current costs of {len(planned)} products; "
+                    f"retrying next poll")
+                planned = []
+            to_write, dropped = app.verify_update_plan(planned, current)
+            stats['already_set'] = len(dropped)
+            statuses.update(dropped)
+
+            for new_cost, group in app.group_writes_by_template(to_write):
+                ok, error = app.update_product_cost(uid, models, [int(row['id']) for _, row in group],
+                                                    new_cost, self.company['id'])
+                for idx, _ in group:
+                    statuses[idx] = "✅ Updated" if ok else "❌ Failed"
+                if ok:
+                    stats['updated'] += len(group)
+                else:
+                    self._remember_retry([candidates[int(row['id'])] for _, row in group])
+                    stats['failed'] += len(group)
+                    log(f"{self.company['name']}: write failed for {len(group)} products, "
+                        f"retrying next poll: {error}")
+
+        if statuses:
+            new_costs = {idx: new_cost for idx, _, new_cost in planned}
+            items = [{
+                'product_id': row['id'],
+                'sku': row['default_code'],
+                'product': row['name'],
+                'old_cost': (current or {}).get(int(row['id']), 0.0),
+                'new_cost': new_costs.get(idx, 0.0),
+                'match_source': app.match_source(row, cost_map),
+                'status': statuses[idx],
+            } for idx, row in df.iterrows() if idx in statuses]
+            app.record_run('watcher', (source['id'], source['name']),
+                           (self.company['id'], self.company['name']), items)
+
+        return done()
+
+
+def load_state():
+    """{'source_cursor': (write_date, id) or None, 'stores': {company id: {...}}}"""
+    state = {'source_cursor': None, 'stores': {}}
+    if not os.path.exists(WATCH_STATE_FILE):
+        return state
+    with open(WATCH_STATE_FILE) as f:
+        saved = json.load(f)
+    if 'stores' not in saved:  # files from before the source cursor was saved
+        saved = {'stores': saved}
+    if saved.get('source_cursor'):
+        state['source_cursor'] = tuple(saved['source_cursor'])
+    for company_id, value in saved['stores'].items():
+        if isinstance(value, list):  # cursor-only files
+            value = {'cursor': value}
+        state['stores'][int(company_id)] = {
+            'cursor': tuple(value['cursor']),
+            'lookup': set(value.get('lookup', [])),
+            'seen': {int(pid): wd for pid, wd in value.get('seen', {}).items()},
+            'retry': {int(pid): row for pid, row in value.get('retry', {}).items()},
+        }
+    return state
+
+
+def save_state(watchers, source_cursor):
+    """Persist cursors, overlap windows, queued lookups and failed writes, so a restart drops nothing"""
+    tmp = WATCH_STATE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({
+            'source_cursor': list(source_cursor) if source_cursor else None,
+            'stores': {w.company['id']: {'cursor': list(w.cursor), 'seen': w.window.seen,
+                                         'lookup': sorted(w.lookup), 'retry': w.retry}
+                       for w in watchers if w.cursor},
+        }, f)
+    os.replace(tmp, WATCH_STATE_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help="seconds between polls")
+    parser.add_argument('--batch-size', type=int, default=WATCH_BATCH_SIZE, help="products per store per poll")
+    parser.add_argument('--since', help="UTC 'YYYY-mm-dd HH:MM:SS' to start from when no cursor is saved "
+                                        "(default: now)")
+    parser.add_argument('--once', action='store_true', help="run a single poll and exit")
+    args = parser.parse_args()
+
+    uid, models = app.get_odoo_connection(app.ODOO_USERNAME, app.ODOO_PASSWORD)
+    if uid is None:
+        log(f"Failed to connect to Odoo: {models}")
+        return 1
+    companies = app.fetch_companies(uid, models)
+    source = next((c for c in companies if c['name'] == app.SOURCE_STORE_NAME), None)
+    if source is None:
+        log(f"Source Store '{app.SOURCE_STORE_NAME}' not found in Odoo.")
+        return 1
+
+    # Odoo stores write_date in UTC
+    start = args.since or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    saved = load_state()
+    watchers = []
+    for c in companies:
+        if c['id'] != source['id']:
+            state = saved['stores'].get(c['id'], {})
+            watcher = CompanyWatcher(c, state.get('cursor', (start, 0)))
+            watcher.window = SeenWindow(state.get('seen'))
+            watcher.lookup.update(state.get('lookup', set()))
+            watcher.retry.update(state.get('retry', {}))
+            watchers.append(watcher)
+
+    source_cache = SourceCostCache(uid, models, source['id'])
+    try:
+        loaded = source_cache.refresh()
+    except Exception as e:
+        log(f"Failed to load source costs: {e}")
+        return 1
+    # Source products costed while the watcher was down (or committed late behind the cursor)
+    if saved['source_cursor']:
+        since = overlap_start(saved['source_cursor'])
+        missed = source_keys(r for r in loaded if (r['write_date'], r['id']) > since)
+        for watcher in watchers:
+            watcher.lookup.update(missed)
+    log(f"Loaded {len(loaded)} source costs; watching {len(watchers)} stores")
+    del loaded
+
+    while True:
+        errors = 0
+        try:
+            changed = source_keys(source_cache.refresh())
+        except Exception as e:
+            # Keep the cached map and its cursor; the next refresh resumes from there
+            errors += 1
+            changed = set()
+            log(f"Source cost refresh failed: {e}")
+        for watcher in watchers:
+            watcher.lookup.update(changed)
+
+        backlog = False
+        for watcher in watchers:
+            try:
+                stats, more = watcher.poll(uid, models, source_cache.cost_map, args.batch_size, source)
+            except Exception as e:
+                # The cursor only moves after a completed poll, so nothing is skipped
+                errors += 1
+                log(f"{watcher.company['name']}: poll failed, cursor kept: {e}")
+                continue
+            backlog = backlog or more
+            if any(stats.values()):
+                log(f"{watcher.company['name']}: {stats['new']} new, {stats['retried']} retried, "
+                    f"{stats['looked_up']} found by source changes, {stats['updated']} updated, "
+                    f"{stats['already_set']} already set, {stats['unmatched']} without source cost, "
+                    f"{stats['failed']} failed")
+        save_state(watchers, source_cache.cursor)
+
+        if args.once:
+            return 1 if errors else 0
+        # Keep draining without waiting while a store still has a full batch queued
+        if not backlog or errors:
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())